@@ -8,18 +8,54 @@ and an enhanced continuous chat feature.
 """
 
 import streamlit as st
+import asyncio
+import httpx
+import numpy as np
+import hashlib
 import json
+import re
+import sqlite3
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from pathlib import Path
+from string import Template
 
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 from agno.storage.agent.sqlite import SqliteAgentStorage
-
-api_key = st.secrets["API_KEY"]
+from openai import OpenAI
+from sqlalchemy import event
 
 # Constants
 APP_TITLE = "Medical Case Trainer for CME"
+CASE_ID = "case-001"
+DB_FILE = "data/medical_trainer.db"
+CASES_DIR = Path(__file__).parent / "cases"
+# Number of case history entries sent verbatim; older entries are summarized
+HISTORY_WINDOW = 3
+# Embedding model and minimum cosine similarity for reusing a paraphrased question's answer
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.85
+# Most chat agent calls running at once on the background loop, across all sessions
+MAX_CONCURRENT_AGENT_CALLS = 4
+# Seconds between refreshes of a chat answer that is still being generated
+CHAT_POLL_SECONDS = 0.25
+
+# SQLite settings applied to every connection: WAL so readers don't block the writer,
+# fewer fsyncs per commit, a 20MB page cache, and waiting on locks instead of failing
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+)
 
 # Setup page config
 st.set_page_config(
@@ -30,74 +66,177 @@ st.set_page_config(
 )
 
 # Define the fixed sequence of case stages
-CASE_SEQUENCE = ["initial", "treatment", "catheterization", "post_intervention"]
+CASE_SEQUENCE = ("initial", "treatment", "catheterization", "post_intervention")
+
+# Predefined options for each step in the sequence
+CASE_OPTIONS = (
+    # Step 0 - Initial workup (initial)
+    (
+        "Complete Blood Count, Metabolic Panel, and EKG", 
+        "Cardiac enzymes and 12-lead EKG", 
+        "Chest X-ray and cardiac monitoring",
+        "CT angiogram with contrast"
+    ),
+    
+    # Step 1 - Initial treatment (treatment)
+    (
+        "Administer aspirin and nitroglycerin", 
+        "Perform immediate cardiac catheterization", 
+        "Start thrombolytic therapy",
+        "Begin full-dose anticoagulation with heparin"
+    ),
+    
+    # Step 2 - Catheterization intervention (catheterization)
+    (
+        "Percutaneous Coronary Intervention (PCI) with stent", 
+        "Medical management with anticoagulation", 
+        "Coronary artery bypass grafting (CABG)",
+        "Balloon angioplasty without stent placement"
+    ),
+    
+    # Step 3 - Post-intervention management (post_intervention)
+    (
+        "Initiate dual antiplatelet therapy, high-intensity statin, beta-blocker, and ACE inhibitor",
+        "Administer aspirin only and continue previous medications",
+        "Start therapeutic anticoagulation with low molecular weight heparin for 3 months",
+        "Arrange outpatient cardiac rehabilitation without medication changes"
+    ),
+)
+DEFAULT_OPTIONS = ("Option 1", "Option 2", "Option 3", "Option 4")
+
+
+@st.cache_data(show_spinner=False)
+def load_case(case_name):
+    """Load a case definition from the cases directory."""
+    with open(CASES_DIR / f"{case_name}.json", encoding="utf-8") as f:
+        return json.load(f)
+
 
 # Sample cardiac case data
-CARDIAC_CASE = {
-    "title": "58-year-old with Acute Chest Pain",
-    "specialty": "Cardiology",
-    "difficulty": "Moderate",
-    "content": """
-# Case: 58-year-old with Acute Chest Pain
-
-## Initial Presentation
-A 58-year-old male presents to the emergency department with sudden onset severe chest pain that began 2 hours ago while mowing his lawn. The pain is described as crushing, radiating to the left arm and jaw, and is rated 8/10 in severity. The patient reports shortness of breath and diaphoresis. He has a history of hypertension, hyperlipidemia, and type 2 diabetes. Current medications include lisinopril, atorvastatin, and metformin. He smokes one pack of cigarettes daily for the past 30 years.
-
-Initial vital signs:
-- BP: 165/95 mmHg
-- HR: 96 bpm
-- RR: 22/min
-- Temp: 98.6°F (37°C)
-- SpO2: 94% on room air
-
-## Lab Results
-### Complete Blood Count
-- WBC: 9.8 x 10^9/L (normal: 4.5-11.0)
-- Hgb: 14.2 g/dL (normal: 13.5-17.5)
-- Hct: 42% (normal: 41-53%)
-- Platelets: 245 x 10^9/L (normal: 150-450)
-
-### Comprehensive Metabolic Panel
-- Na: 138 mEq/L (normal: 135-145)
-- K: 4.2 mEq/L (normal: 3.5-5.0)
-- Cl: 101 mEq/L (normal: 98-107)
-- CO2: 24 mEq/L (normal: 22-30)
-- BUN: 18 mg/dL (normal: 7-20)
-- Cr: 1.1 mg/dL (normal: 0.6-1.2)
-- Glucose: 168 mg/dL (normal: 70-99)
-
-### Cardiac Enzymes
-- Troponin I: 0.32 ng/mL (normal: <0.04)
-- CK-MB: 8.5 ng/mL (normal: <5.0)
-
-### Lipid Panel
-- Total Cholesterol: 235 mg/dL (normal: <200)
-- LDL: 155 mg/dL (normal: <100)
-- HDL: 38 mg/dL (normal: >40)
-- Triglycerides: 210 mg/dL (normal: <150)
-
-## Diagnostic Imaging
-### EKG Findings
-12-lead EKG shows 2 mm ST-segment elevation in leads II, III, and aVF with reciprocal ST depression in leads I and aVL.
-
-### Optimal Management Path
-Initial treatment should include aspirin 325 mg, sublingual nitroglycerin, and morphine for pain. This should be followed by immediate cardiac catheterization which will reveal a 95% occlusion of the right coronary artery. Percutaneous coronary intervention (PCI) with drug-eluting stent placement is the optimal treatment. Post-intervention therapy should include dual antiplatelet therapy, high-intensity statin, beta-blocker, and ACE inhibitor.
-
-### Learning Points
-1. Classic presentation of acute STEMI includes crushing chest pain radiating to the arm and jaw, associated with shortness of breath and diaphoresis.
-2. Inferior wall MIs typically present with ST elevation in leads II, III, and aVF.
-3. Primary PCI is the preferred reperfusion strategy for STEMI when available in a timely manner.
-4. Optimal medical therapy post-MI includes dual antiplatelet therapy, statins, beta-blockers, and ACE inhibitors.
-5. Risk factor modification, including smoking cessation, is crucial for secondary prevention.
-
-### Correct Path Indicators
-- Initial workup: Complete Blood Count, Metabolic Panel, and EKG
-- Initial treatment: Administer aspirin and nitroglycerin
-- Definitive treatment: Perform immediate cardiac catheterization
-- Intervention: Percutaneous Coronary Intervention (PCI) with stent
-- Secondary prevention: Comprehensive post-MI care (DAPT, statin, beta-blocker, ACE inhibitor)
-"""
-}
+CARDIAC_CASE = load_case("cardiac")
+
+# Progression prompts, built once at import and filled in per decision
+
+# Step 0 - Initial labs/workup
+PROMPT_STEP_0 = Template("""
+Conversation history:
+$history
+
+The physician has requested: "$action"
+
+Provide appropriate initial lab results, imaging findings, or other requested clinical data.
+Be sure to include EKG findings that show ST elevation and elevated troponin.
+Then present the patient's CURRENT STATUS and ask what initial intervention they would like to pursue.
+
+DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
+""")
+
+# Step 1 - Initial treatment
+PROMPT_STEP_1 = Template("""
+Conversation history:
+$history
+
+Physician decisions so far:
+$decisions
+
+The physician has chosen: "$action"
+
+Advance the case by:
+1. Describing the patient's response to initial treatment
+2. Explaining that the cardiologist recommends immediate cardiac catheterization
+3. Describe the findings from the coronary angiography showing 95% occlusion of the right coronary artery
+4. Ask what intervention they would recommend for this catheterization finding
+
+DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
+""")
+
+# Step 2 - Catheterization intervention
+PROMPT_STEP_2 = Template("""
+Conversation history:
+$history
+
+Physician decisions so far:
+$decisions
+
+The physician has chosen: "$action"
+
+Advance the case by:
+1. Describing that the PCI with stent placement procedure was successful
+2. Detailing the immediate post-procedure results and patient status
+3. Explaining that the patient is now stable post-PCI
+4. Ask what post-intervention management plan they would like to implement
+
+DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
+""")
+
+# Step 3 - Correct comprehensive post-MI care, completing the case
+PROMPT_CASE_COMPLETE = Template("""
+Conversation history:
+$history
+
+Physician decisions so far:
+$decisions
+
+The physician has chosen: "$action"
+
+This is the correct comprehensive post-MI approach and completes the case management.
+
+Provide:
+1. A detailed description of the positive outcome for the patient
+2. A comprehensive explanation of why this was the optimal approach
+3. An educational summary of the key learning points from this case
+4. Evidence-based rationale with 2-3 specific literature references
+5. Explicitly congratulate the physician on completing the case successfully
+6. State that they have earned CME credit for this case completion
+
+Make your response comprehensive and educational, suitable for medical CME credit.
+""")
+
+# Step 3 - Suboptimal post-intervention management
+PROMPT_STEP_3 = Template("""
+Conversation history:
+$history
+
+Physician decisions so far:
+$decisions
+
+The physician has chosen: "$action"
+
+The patient has already had a successful PCI with stent placement.
+
+Explain what is missing or suboptimal about their post-PCI care selection.
+
+Clearly explain that guidelines recommend comprehensive secondary prevention with DAPT, 
+statin, beta-blocker, and ACE inhibitor therapy post-MI.
+Ask what post-intervention management they would like to choose instead.
+
+DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
+""")
+
+# Any extra steps
+PROMPT_EXTRA_STEP = Template("""
+Conversation history:
+$history
+
+Physician decisions so far:
+$decisions
+
+The physician has chosen: "$action"
+
+Provide feedback on this decision and ask if they would like to make any additional changes
+to their management plan.
+
+DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
+""")
+
+# Prompt for each step index; steps past the last entry reuse the extra-step prompt
+PROMPT_TEMPLATES = [PROMPT_STEP_0, PROMPT_STEP_1, PROMPT_STEP_2, PROMPT_STEP_3, PROMPT_EXTRA_STEP]
+
+# Comprehensive post-MI care: DAPT, a statin, and a beta-blocker or ACE inhibitor
+CORRECT_POST_MI_RE = re.compile(
+    r"(?=.*(?:dual antiplatelet|dapt))(?=.*statin)(?=.*(?:beta.?blocker|ace))",
+    re.IGNORECASE
+)
 
 # User identification - in a real app, this would come from authentication
 if "user_id" not in st.session_state:
@@ -111,41 +250,440 @@ if "case_history" not in st.session_state:
     st.session_state.case_history = []
 if "user_decisions" not in st.session_state:
     st.session_state.user_decisions = []
+# Summary of the case history entries that have been dropped from prompts
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = ""
+if "summarized_count" not in st.session_state:
+    st.session_state.summarized_count = 0
+# Prompt-ready text of the summary and recent history, extended as entries are added
+if "history_str" not in st.session_state:
+    st.session_state.history_str = ""
+# Prompt-ready text of the decisions, extended as decisions are made
+if "decisions_str" not in st.session_state:
+    st.session_state.decisions_str = ""
 if "case_completed" not in st.session_state:
     st.session_state.case_completed = False
 if "case_started" not in st.session_state:
     st.session_state.case_started = False
 if "agent" not in st.session_state:
     st.session_state.agent = None
+if "chat_agent" not in st.session_state:
+    st.session_state.chat_agent = None
+if "initial_presentation" not in st.session_state:
+    st.session_state.initial_presentation = None
+if "latencies" not in st.session_state:
+    st.session_state.latencies = []
 if "cme_earned" not in st.session_state:
     st.session_state.cme_earned = False
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
-if "chat_processing" not in st.session_state:
-    st.session_state.chat_processing = False
+if "pending_chat" not in st.session_state:
+    st.session_state.pending_chat = None
+if "chat_error" not in st.session_state:
+    st.session_state.chat_error = None
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Apply the SQLite tuning pragmas to a new connection."""
+    for pragma in SQLITE_PRAGMAS:
+        dbapi_connection.execute(pragma)
+
+
+# Set while agent storage is writing, so its transactions take the write lock up front
+WRITE_TRANSACTION = ContextVar("write_transaction", default=False)
+
+
+def begin_transaction(connection):
+    """Begin a transaction: IMMEDIATE for session writes, deferred for reads."""
+    connection.exec_driver_sql("BEGIN IMMEDIATE" if WRITE_TRANSACTION.get() else "BEGIN")
+
+
+@contextmanager
+def write_transaction():
+    """Mark the storage transactions started inside the block as writes."""
+    token = WRITE_TRANSACTION.set(True)
+    try:
+        yield
+    finally:
+        WRITE_TRANSACTION.reset(token)
+
+
+class SessionStorage(SqliteAgentStorage):
+    """Agent session storage whose writes take the SQLite write lock when they begin."""
+    
+    def upsert(self, *args, **kwargs):
+        with write_transaction():
+            return super().upsert(*args, **kwargs)
+    
+    def delete_session(self, *args, **kwargs):
+        with write_transaction():
+            return super().delete_session(*args, **kwargs)
+
+
+def tune_storage_engine(engine):
+    """Apply the SQLite settings to every connection the agent storage engine opens."""
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection)
+        # Let SQLAlchemy's begin event control transactions instead of the sqlite3 driver
+        dbapi_connection.isolation_level = None
+    
+    event.listen(engine, "begin", begin_transaction)
+    
+    # Drop any connections opened before the listeners were attached
+    engine.dispose()
+
+
+class LLMCache:
+    """Caches LLM responses in memory (LRU) and in the SQLite database.
+    
+    Besides exact keys, responses can be looked up by question embedding within a
+    scope, so paraphrased questions at the same point in the case share an answer.
+    """
+    
+    def __init__(self, db_file, max_entries=256, max_similar_entries=64, ttl_seconds=24 * 60 * 60):
+        self.max_entries = max_entries
+        self.max_similar_entries = max_similar_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        # Per scope: ring buffer of normalized embeddings, with responses and creation times by row
+        self._semantic = {}
+        # Responses are stored from the background event loop thread as well
+        self._lock = threading.Lock()
+        
+        Path(db_file).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        apply_sqlite_pragmas(self._conn)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, response TEXT, created_at INT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_semantic_cache ("
+            "scope TEXT, embedding BLOB, response TEXT, created_at INT)"
+        )
+        
+        # Drop expired entries, then load the semantic ones so lookups are served from memory
+        expires_before = int(time.time()) - self.ttl_seconds
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (expires_before,))
+        self._conn.execute("DELETE FROM llm_semantic_cache WHERE created_at < ?", (expires_before,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT scope, embedding, response, created_at FROM llm_semantic_cache ORDER BY created_at, rowid"
+        ).fetchall()
+        for scope, embedding, response, created_at in rows:
+            self._add_semantic(scope, np.frombuffer(embedding, dtype=np.float32), response, created_at)
+    
+    @staticmethod
+    def make_key(*parts):
+        """Build a cache key from the parts that determine the response."""
+        return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    
+    def get(self, key):
+        """Return the cached response for a key, or None if missing or expired."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                entry = self._conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if entry is None:
+                return None
+            
+            response, created_at = entry
+            if time.time() - created_at > self.ttl_seconds:
+                self._memory.pop(key, None)
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            
+            self._remember(key, entry)
+            return response
+    
+    def set(self, key, response):
+        """Store a response under a key."""
+        entry = (response, int(time.time()))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)",
+                (key, *entry)
+            )
+            self._conn.commit()
+            self._remember(key, entry)
+    
+    def get_similar(self, scope, embedding):
+        """Return the response to the most similar cached question in a scope, if close enough."""
+        query = self._normalize(embedding)
+        with self._lock:
+            entries = self._semantic.get(scope)
+            if entries is None:
+                return None
+            
+            # Only consider unexpired entries, forgetting the scope once all have expired
+            count = entries["count"]
+            valid = entries["created_at"][:count] >= time.time() - self.ttl_seconds
+            if not valid.any():
+                del self._semantic[scope]
+                return None
+            
+            similarities = np.where(valid, entries["matrix"][:count] @ query, -np.inf)
+            best = int(similarities.argmax())
+            if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+                return None
+            return entries["responses"][best]
+    
+    def set_similar(self, scope, embedding, response):
+        """Store a response under a question embedding within a scope."""
+        vector = self._normalize(embedding)
+        created_at = int(time.time())
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO llm_semantic_cache (scope, embedding, response, created_at) VALUES (?, ?, ?, ?)",
+                (scope, vector.tobytes(), response, created_at)
+            )
+            # Keep the table in line with memory: unexpired, and the newest entries per scope
+            self._conn.execute(
+                "DELETE FROM llm_semantic_cache WHERE created_at < ?",
+                (created_at - self.ttl_seconds,)
+            )
+            self._conn.execute(
+                "DELETE FROM llm_semantic_cache WHERE scope = ? AND rowid NOT IN ("
+                "SELECT rowid FROM llm_semantic_cache WHERE scope = ? ORDER BY created_at DESC, rowid DESC LIMIT ?)",
+                (scope, scope, self.max_similar_entries)
+            )
+            self._conn.commit()
+            self._add_semantic(scope, vector, response, created_at)
+    
+    @staticmethod
+    def _normalize(embedding):
+        """Return the embedding as a unit-length float32 vector."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+    
+    def _add_semantic(self, scope, vector, response, created_at):
+        """Add a normalized embedding and its response to a scope, replacing the oldest if full."""
+        entries = self._semantic.get(scope)
+        if entries is None:
+            capacity = self.max_similar_entries
+            entries = self._semantic[scope] = {
+                "matrix": np.zeros((capacity, vector.shape[0]), dtype=np.float32),
+                "responses": [None] * capacity,
+                "created_at": np.zeros(capacity, dtype=np.int64),
+                "count": 0,
+                "next": 0
+            }
+        
+        row = entries["next"]
+        entries["matrix"][row] = vector
+        entries["responses"][row] = response
+        entries["created_at"][row] = created_at
+        entries["next"] = (row + 1) % self.max_similar_entries
+        entries["count"] = min(entries["count"] + 1, self.max_similar_entries)
+    
+    def _remember(self, key, entry):
+        """Add an entry to the in-memory LRU, evicting the oldest if full."""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+@st.cache_resource
+def get_storage():
+    """Return the agent session storage shared by all sessions."""
+    # Agno only builds a file-backed engine from db_file, so tune the engine it creates
+    storage = SessionStorage(
+        table_name="medical_trainer_sessions", 
+        db_file=DB_FILE
+    )
+    tune_storage_engine(storage.db_engine)
+    return storage
+
+
+@st.cache_resource
+def get_api_key():
+    """Return the OpenAI API key, read from Streamlit secrets once per process."""
+    return st.secrets["API_KEY"]
+
+
+@st.cache_resource
+def get_http_client():
+    """Return the HTTP client shared by all OpenAI models, reusing its connection pool."""
+    return httpx.Client()
+
+
+@st.cache_resource
+def get_async_http_client():
+    """Return the async HTTP client shared by models that run on the background event loop."""
+    return httpx.AsyncClient()
+
+
+@st.cache_resource
+def get_openai_client():
+    """Return the OpenAI client used for embeddings."""
+    return OpenAI(api_key=get_api_key(), http_client=get_http_client())
+
+
+def decisions_version(decisions):
+    """Return a short, order-independent version tag for a set of decisions."""
+    return hashlib.md5("\n".join(sorted(decisions)).encode()).hexdigest()[:8]
+
+
+@st.cache_resource
+def get_llm_cache():
+    """Return the LLM response cache shared by all sessions."""
+    return LLMCache(DB_FILE)
+
+
+@st.cache_resource
+def get_event_loop():
+    """Start the background event loop that runs async agent calls."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+@st.cache_resource
+def get_agent_semaphore():
+    """Return the semaphore limiting agent calls in flight on the background loop."""
+    async def create_semaphore():
+        return asyncio.Semaphore(MAX_CONCURRENT_AGENT_CALLS)
+    
+    # Create it on the loop that uses it
+    return asyncio.run_coroutine_threadsafe(create_semaphore(), get_event_loop()).result()
+
+
+@contextmanager
+def timed(label):
+    """Record how long the wrapped block takes in the session's latency log.
+    
+    Yields the log record so callers can add token counts once the call finishes.
+    """
+    record = {"label": label}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        st.session_state.latencies.append(record)
+
+
+def token_usage(run_response):
+    """Return the input and output token counts from an agent run's metrics."""
+    metrics = (run_response.metrics if run_response else None) or {}
+    usage = {}
+    for name in ("input_tokens", "output_tokens"):
+        value = metrics.get(name, 0)
+        # Agno reports per-message counts as lists
+        usage[name] = sum(value) if isinstance(value, list) else value
+    return usage
+
+
+def build_progress_prompt(step_index, action, case_complete, history, decisions):
+    """Build the progression prompt for a step."""
+    # Fixed sequence of prompts based on step index, not dependent on content analysis
+    if case_complete:
+        template = PROMPT_CASE_COMPLETE
+    else:
+        template = PROMPT_TEMPLATES[min(step_index, len(PROMPT_TEMPLATES) - 1)]
+    return template.substitute(history=history, decisions=decisions, action=action)
+
+
+def decision_line(step_number, decision):
+    """Return the decisions prompt text line for a step's decision."""
+    return f"Step {step_number}: {decision}"
+
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def build_first_step_prompt(action):
+    """Build the step 0 prompt, shared across sessions.
+    
+    At step 0 the history is just the hand-authored presentation and the only decision
+    is the action, so the action alone is the cache key.
+    """
+    return build_progress_prompt(
+        0, action, False, CARDIAC_CASE["initial_presentation"], decision_line(1, action)
+    )
+
+
+async def run_agent_async(agent, prompt, chunks, semaphore):
+    """Run the agent without blocking the script thread, collecting streamed chunks."""
+    async with semaphore:
+        response_stream = await agent.arun(prompt, stream=True)
+        async for chunk in response_stream:
+            if chunk.content:
+                chunks.append(chunk.content)
+    return "".join(chunks)
+
+
+async def answer_question_async(agent, prompt, question, scope, llm_cache, openai_client, chunks, semaphore, stats, finished):
+    """Answer a question from the semantic cache if a similar one was asked, otherwise run the agent.
+    
+    Timing and token counts are written to ``stats``, since this runs outside the script thread.
+    ``finished`` is set once the call, including the agent's session write, is over.
+    """
+    try:
+        start = time.perf_counter()
+        try:
+            response = await asyncio.to_thread(
+                openai_client.embeddings.create, model=EMBEDDING_MODEL, input=question
+            )
+            embedding = response.data[0].embedding
+        except Exception:
+            # Without an embedding, skip the semantic cache and just ask the agent
+            embedding = None
+        
+        cached_answer = llm_cache.get_similar(scope, embedding) if embedding is not None else None
+        if cached_answer is not None:
+            chunks.append(cached_answer)
+            stats.update(label="chat_semantic_cache", seconds=round(time.perf_counter() - start, 3))
+            return cached_answer
+        
+        answer = await run_agent_async(agent, prompt, chunks, semaphore)
+        stats.update(label="chat", seconds=round(time.perf_counter() - start, 3), **token_usage(agent.run_response))
+        if embedding is not None:
+            llm_cache.set_similar(scope, embedding, answer)
+        return answer
+    finally:
+        finished.set()
 
 
 class MedicalCaseAgent:
     """Handles the agent interactions for medical case training."""
     
     @staticmethod
-    def initialize_agent(user_id, case_id="case-001"):
-        """Initialize the Agno agent with persistent storage."""
+    def initialize_agent(user_id, case_id=CASE_ID, model_id="gpt-4o", session_id=None, http_client=None, history_runs=0):
+        """Initialize the Agno agent with persistent storage.
+        
+        Prompts carry the case history themselves, so by default the agent's stored
+        runs are not re-sent; ``history_runs`` adds that many previous runs.
+        """
+        # Use a session ID that combines user and case unless one is given
+        session_id = session_id or f"user_{user_id}_case_{case_id}"
+        
         agent = Agent(
-            model=OpenAIChat(id="gpt-4o",api_key=api_key),
-            # Store agent sessions in a database
-            storage=SqliteAgentStorage(
-                table_name="medical_trainer_sessions", 
-                db_file="data/medical_trainer.db"
+            model=OpenAIChat(
+                id=model_id,
+                api_key=get_api_key(),
+                http_client=http_client or get_http_client(),
+                # Route this session's requests to the same prompt-prefix cache
+                request_params={"extra_body": {"prompt_cache_key": session_id}}
             ),
-            # Use a session ID that combines user and case
-            session_id=f"user_{user_id}_case_{case_id}",
-            # Include chat history in context
-            add_history_to_messages=True,
-            description="""
+            # Store agent sessions in a database
+            storage=get_storage(),
+            session_id=session_id,
+            # Include chat history in context only when asked for
+            add_history_to_messages=history_runs > 0,
+            num_history_runs=history_runs,
+            # The case reference lives in the system message so every prompt shares
+            # the same leading prefix, which OpenAI caches across turns
+            description=f"""
             You are an expert medical educator specializing in case-based learning for physicians.
             Your role is to guide medical professionals through realistic patient cases,
             presenting clinical information in stages and evaluating their decision-making.
+            
+            Here is the full case information for your reference (the learner won't see all of this yet):
+            {CARDIAC_CASE["content"]}
             """,
             instructions=[
                 "Present medical case information in a clear, professional manner",
@@ -161,19 +699,39 @@ class MedicalCaseAgent:
         )
         return agent
     
+    @staticmethod
+    def initialize_chat_agent(user_id, case_id=CASE_ID):
+        """Initialize the agent that answers chat questions with a smaller, faster model.
+        
+        It keeps its own session so its stored runs don't overwrite the case agent's;
+        chat prompts get the case progression from the case history and decisions,
+        and only the previous question and answer are added for follow-ups.
+        """
+        return MedicalCaseAgent.initialize_agent(
+            user_id,
+            case_id,
+            model_id="gpt-4o-mini",
+            session_id=f"user_{user_id}_case_{case_id}_chat",
+            # The chat agent only runs through agent.arun, which needs an async client
+            http_client=get_async_http_client(),
+            history_runs=1
+        )
+    
+    @staticmethod
+    def clear_session(agent):
+        """Delete the agent's stored session, removing its conversation history."""
+        agent.storage.delete_session(agent.session_id)
+    
     @staticmethod
     def start_case(agent):
         """Start a new medical case by retrieving the initial presentation."""
-        # Get the case content
-        case_content = CARDIAC_CASE["content"]
+        # Use the hand-authored presentation when the case provides one
+        if CARDIAC_CASE.get("initial_presentation"):
+            return CARDIAC_CASE["initial_presentation"]
         
-        prompt = f"""
+        prompt = """
         You'll be facilitating a medical case for a physician learner.
         
-        Here is the full case information for your reference (the learner won't see all of this yet):
-        
-        {case_content}
-        
         Present only the initial clinical presentation with:
         1. Brief patient demographics
         2. Chief complaint
@@ -183,61 +741,56 @@ class MedicalCaseAgent:
         Do not reveal the diagnosis or full case details yet. Wait for the user to request labs or choose an initial intervention.
         """
         
-        response = agent.run(prompt)
+        # Otherwise generate it, streaming the presentation as it arrives
+        with timed("llm_start_case") as record:
+            initial_presentation = render_stream(agent.run(prompt, stream=True))
+            record.update(token_usage(agent.run_response))
+        return initial_presentation
+    
+    @staticmethod
+    def summarize_history(summary, entries):
+        """Fold case history entries into the running summary using a smaller model."""
+        summarizer = Agent(
+            model=OpenAIChat(id="gpt-4o-mini", api_key=get_api_key(), http_client=get_http_client()),
+            description="You summarize medical case progressions for a medical educator.",
+        )
+        
+        entries_text = "\n\n".join(entries)
+        prompt = f"""
+        Summary so far:
+        {summary or "(none)"}
+        
+        New case events:
+        {entries_text}
+        
+        Write a single paragraph that updates the summary with the new case events.
+        Keep the clinical findings, results and decisions that later steps depend on.
+        """
+        
+        with timed("llm_summary") as record:
+            response = summarizer.run(prompt)
+            record.update(token_usage(response))
         return response.content
     
     @staticmethod
     def get_case_options(step_index):
         """Return predefined options for each step in the sequence."""
-        options = [
-            # Step 0 - Initial workup (initial)
-            [
-                "Complete Blood Count, Metabolic Panel, and EKG", 
-                "Cardiac enzymes and 12-lead EKG", 
-                "Chest X-ray and cardiac monitoring",
-                "CT angiogram with contrast"
-            ],
-            
-            # Step 1 - Initial treatment (treatment)
-            [
-                "Administer aspirin and nitroglycerin", 
-                "Perform immediate cardiac catheterization", 
-                "Start thrombolytic therapy",
-                "Begin full-dose anticoagulation with heparin"
-            ],
-            
-            # Step 2 - Catheterization intervention (catheterization)
-            [
-                "Percutaneous Coronary Intervention (PCI) with stent", 
-                "Medical management with anticoagulation", 
-                "Coronary artery bypass grafting (CABG)",
-                "Balloon angioplasty without stent placement"
-            ],
-            
-            # Step 3 - Post-intervention management (post_intervention)
-            [
-                "Initiate dual antiplatelet therapy, high-intensity statin, beta-blocker, and ACE inhibitor",
-                "Administer aspirin only and continue previous medications",
-                "Start therapeutic anticoagulation with low molecular weight heparin for 3 months",
-                "Arrange outpatient cardiac rehabilitation without medication changes"
-            ]
-        ]
-        
-        # Return appropriate options based on the step
-        if step_index < len(options):
-            return options[step_index]
+        if step_index < len(CASE_OPTIONS):
+            return CASE_OPTIONS[step_index]
         else:
-            return ["Option 1", "Option 2", "Option 3", "Option 4"]  # Default fallback
+            return DEFAULT_OPTIONS  # Default fallback
+    
+    @staticmethod
+    def completes_case(action, step_index):
+        """Return whether the action is the correct final step that completes the case."""
+        return step_index == 3 and bool(CORRECT_POST_MI_RE.search(action))
     
     @staticmethod
     def progress_case(agent, action, step_index):
         """Progress the case based on the user's selected action."""
-        # Get the case content
-        case_content = CARDIAC_CASE["content"]
-        
         # Build the conversation history
-        history = "\n\n".join(st.session_state.case_history)
-        decisions = "\n".join([f"Step {i+1}: {decision}" for i, decision in enumerate(st.session_state.user_decisions)])
+        history = build_history_context()
+        decisions = st.session_state.decisions_str
         
         # Get the current stage based on the step index
         if step_index < len(CASE_SEQUENCE):
@@ -245,161 +798,24 @@ class MedicalCaseAgent:
         else:
             current_stage = "post_intervention"  # Default to post-intervention for any extra steps
         
-        # Determine if this action is a correct one
-        action_lower = action.lower()
-        case_near_complete = False
+        # Check if this is the correct comprehensive post-MI care, which completes the case
+        case_near_complete = MedicalCaseAgent.completes_case(action, step_index)
         
-        # Fixed sequence of prompts based on step index, not dependent on content analysis
-        if step_index == 0:  # Initial labs/workup
-            prompt = f"""
-            Case reference (not to be fully revealed to the learner yet):
-            {case_content}
-            
-            Conversation history:
-            {history}
-            
-            The physician has requested: "{action}"
-            
-            Provide appropriate initial lab results, imaging findings, or other requested clinical data.
-            Be sure to include EKG findings that show ST elevation and elevated troponin.
-            Then present the patient's CURRENT STATUS and ask what initial intervention they would like to pursue.
-            
-            DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
-            """
-        elif step_index == 1:  # Initial treatment
-            prompt = f"""
-            Case reference:
-            {case_content}
-            
-            Conversation history:
-            {history}
-            
-            Physician decisions so far:
-            {decisions}
-            
-            The physician has chosen: "{action}"
-            
-            Advance the case by:
-            1. Describing the patient's response to initial treatment
-            2. Explaining that the cardiologist recommends immediate cardiac catheterization
-            3. Describe the findings from the coronary angiography showing 95% occlusion of the right coronary artery
-            4. Ask what intervention they would recommend for this catheterization finding
-            
-            DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
-            """
-        elif step_index == 2:  # Catheterization intervention
-            prompt = f"""
-            Case reference:
-            {case_content}
-            
-            Conversation history:
-            {history}
-            
-            Physician decisions so far:
-            {decisions}
-            
-            The physician has chosen: "{action}"
-            
-            Advance the case by:
-            1. Describing that the PCI with stent placement procedure was successful
-            2. Detailing the immediate post-procedure results and patient status
-            3. Explaining that the patient is now stable post-PCI
-            4. Ask what post-intervention management plan they would like to implement
-            
-            DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
-            """
-        elif step_index == 3:  # Post-intervention management
-            # Check if this is the correct comprehensive post-MI care
-            if (
-                ("dual antiplatelet" in action_lower or "dapt" in action_lower) and
-                ("statin" in action_lower) and
-                (("beta" in action_lower and "blocker" in action_lower) or "ace" in action_lower)
-            ):
-                case_near_complete = True
-                prompt = f"""
-                Case reference:
-                {case_content}
-                
-                Conversation history:
-                {history}
-                
-                Physician decisions so far:
-                {decisions}
-                
-                The physician has chosen: "{action}"
-                
-                This is the correct comprehensive post-MI approach and completes the case management.
-                
-                Provide:
-                1. A detailed description of the positive outcome for the patient
-                2. A comprehensive explanation of why this was the optimal approach
-                3. An educational summary of the key learning points from this case
-                4. Evidence-based rationale with 2-3 specific literature references
-                5. Explicitly congratulate the physician on completing the case successfully
-                6. State that they have earned CME credit for this case completion
-                
-                Make your response comprehensive and educational, suitable for medical CME credit.
-                """
-            else:
-                prompt = f"""
-                Case reference:
-                {case_content}
-                
-                Conversation history:
-                {history}
-                
-                Physician decisions so far:
-                {decisions}
-                
-                The physician has chosen: "{action}"
-                
-                The patient has already had a successful PCI with stent placement.
-                
-                Explain what is missing or suboptimal about their post-PCI care selection.
-                
-                Clearly explain that guidelines recommend comprehensive secondary prevention with DAPT, 
-                statin, beta-blocker, and ACE inhibitor therapy post-MI.
-                Ask what post-intervention management they would like to choose instead.
-                
-                DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
-                """
-        else:  # Any extra steps
-            prompt = f"""
-            Case reference:
-            {case_content}
-            
-            Conversation history:
-            {history}
-            
-            Physician decisions so far:
-            {decisions}
-            
-            The physician has chosen: "{action}"
-            
-            Provide feedback on this decision and ask if they would like to make any additional changes
-            to their management plan.
-            
-            DO NOT PROVIDE ANY OPTIONS yourself as these will be pre-defined in the interface.
-            """
-        
-        response = agent.run(prompt)
-        
-        # Mark case as completed if this was the final successful step
-        if case_near_complete:
-            st.session_state.case_completed = True
-            st.session_state.cme_earned = True
+        # Later steps include each learner's own generated history, so only the
+        # step 0 prompt from a hand-authored presentation is shared across sessions
+        if step_index == 0 and CARDIAC_CASE.get("initial_presentation"):
+            prompt = build_first_step_prompt(action)
+        else:
+            prompt = build_progress_prompt(step_index, action, case_near_complete, history, decisions)
         
-        return response.content
+        return agent.run(prompt, stream=True)
     
     @staticmethod
     def ask_question(agent, question, step_index):
         """Allows the user to ask questions about the case with appropriate context."""
-        # Get the case content for context
-        case_content = CARDIAC_CASE["content"]
-        
         # Build the conversation history
-        history = "\n\n".join(st.session_state.case_history)
-        decisions = "\n".join([f"Step {i+1}: {decision}" for i, decision in enumerate(st.session_state.user_decisions)])
+        history = build_history_context()
+        decisions = st.session_state.decisions_str
         
         # Get the current stage of the case
         if step_index < len(CASE_SEQUENCE):
@@ -414,9 +830,6 @@ class MedicalCaseAgent:
         
         "{question}"
         
-        Case reference (for your understanding only):
-        {case_content}
-        
         Current case progression:
         - Step index: {step_index}
         - Current stage: {current_stage} 
@@ -439,39 +852,134 @@ class MedicalCaseAgent:
         Respond as an experienced medical educator providing guidance during a case-based learning session.
         """
         
-        response = agent.run(prompt)
-        return response.content
+        # Reuse the answer to the same question asked at the same point in the case
+        llm_cache = get_llm_cache()
+        scope = LLMCache.make_key(
+            agent.model.id,
+            CASE_ID,
+            step_index,
+            decisions_version(st.session_state.user_decisions)
+        )
+        cache_key = LLMCache.make_key(scope, question.strip().lower())
+        cached_answer = llm_cache.get(cache_key)
+        if cached_answer is not None:
+            future = Future()
+            future.set_result(cached_answer)
+            finished = threading.Event()
+            finished.set()
+            return {
+                "future": future,
+                "chunks": [cached_answer],
+                "stats": {"label": "chat_exact_cache", "seconds": 0.0},
+                "finished": finished
+            }
+        
+        # Run on the background loop so the decision interface stays usable, checking
+        # for a paraphrase of an earlier question before calling the model
+        chunks = []
+        stats = {}
+        finished = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            answer_question_async(
+                agent,
+                prompt,
+                question,
+                scope,
+                llm_cache,
+                get_openai_client(),
+                chunks,
+                get_agent_semaphore(),
+                stats,
+                finished
+            ),
+            get_event_loop()
+        )
+        
+        def store_answer(done_future):
+            if not done_future.cancelled() and done_future.exception() is None:
+                llm_cache.set(cache_key, done_future.result())
+        
+        future.add_done_callback(store_answer)
+        return {"future": future, "chunks": chunks, "stats": stats, "finished": finished}
+
+
+def build_history_context():
+    """Return the case history for prompts: a summary of older entries plus the recent ones.
+    
+    Entries older than the last HISTORY_WINDOW are folded into the summary first. If the
+    summary can't be updated, they stay verbatim and are folded in before a later prompt.
+    """
+    start = st.session_state.summarized_count
+    end = len(st.session_state.case_history) - HISTORY_WINDOW
+    if end <= start:
+        return st.session_state.history_str
+    
+    try:
+        summary = MedicalCaseAgent.summarize_history(
+            st.session_state.history_summary,
+            st.session_state.case_history[start:end]
+        )
+    except Exception:
+        return st.session_state.history_str
+    st.session_state.history_summary = summary
+    st.session_state.summarized_count = end
+    
+    # Rebuild the prompt text from the summary and the bounded recent window
+    recent = "\n\n".join(st.session_state.case_history[end:])
+    st.session_state.history_str = (
+        f"Summary of earlier case events:\n{summary}\n\nRecent:\n{recent}"
+    )
+    return st.session_state.history_str
+
+
+def append_case_history(entry):
+    """Add an entry to the case history and to its prompt text."""
+    st.session_state.case_history.append(entry)
+    if st.session_state.history_str:
+        st.session_state.history_str += "\n\n" + entry
+    else:
+        st.session_state.history_str = entry
+
 
+def append_user_decision(decision):
+    """Record a decision and add it to the decisions prompt text."""
+    st.session_state.user_decisions.append(decision)
+    line = decision_line(len(st.session_state.user_decisions), decision)
+    if st.session_state.decisions_str:
+        st.session_state.decisions_str += "\n" + line
+    else:
+        st.session_state.decisions_str = line
+
+
+def render_stream(response_iter):
+    """Render a streamed agent response as it arrives and return the full text."""
+    placeholder = st.empty()
+    buf = []
+    for chunk in response_iter:
+        if chunk.content:
+            buf.append(chunk.content)
+            placeholder.markdown("".join(buf))
+    return "".join(buf)
 
-def process_chat_input():
-    """Process the chat input when Enter is pressed."""
-    user_question = st.session_state.chat_input
-    if user_question and not st.session_state.chat_processing:
-        # Set processing flag to prevent multiple submissions
-        st.session_state.chat_processing = True
+
+def process_chat_input(user_question):
+    """Start answering a submitted chat question in the background."""
+    if st.session_state.pending_chat is None:
+        st.session_state.chat_error = None
         
-        # Get response
-        response = MedicalCaseAgent.ask_question(
-            st.session_state.agent,
+        # The chat interface streams the result as it arrives
+        pending_chat = MedicalCaseAgent.ask_question(
+            st.session_state.chat_agent,
             user_question,
             st.session_state.current_step
         )
-        
-        # Add to chat history
-        st.session_state.chat_history.append({"question": user_question, "answer": response})
-        
-        # Clear the input
-        st.session_state.chat_input = ""
-        
-        # Reset processing flag
-        st.session_state.chat_processing = False
-        
-        # Rerun to update the interface
-        st.rerun()
+        pending_chat["question"] = user_question
+        st.session_state.pending_chat = pending_chat
 
 
+@st.fragment
 def render_chat_interface():
-    """Render the chat interface."""
+    """Render the chat interface; asking a question reruns only this fragment."""
     # Create a visually distinct chat container
     chat_container = st.container(border=True)
     
@@ -480,30 +988,122 @@ def render_chat_interface():
         st.markdown("*Ask any questions about the case, medical concepts, or guidelines*")
         
         # Add previous chat history
-        if st.session_state.chat_history:
-            for chat in st.session_state.chat_history:
-                with st.container(border=True):
-                    st.markdown(f"**Question:** {chat['question']}")
-                    st.markdown(f"**Answer:** {chat['answer']}")
-        
-        # Add chat input with Enter key support
-        st.text_input(
-            "Your question:",
-            key="chat_input",
-            on_change=process_chat_input,
-            placeholder="Type your question here and press Enter"
+        for chat in st.session_state.chat_history:
+            st.chat_message("user").write(chat["question"])
+            st.chat_message("assistant").write(chat["answer"])
+        
+        # Reserve space above the input for the answer being generated
+        pending_container = st.container()
+        
+        # Add chat input; only one question is answered at a time
+        user_question = st.chat_input(
+            "Type your question here and press Enter",
+            key="chat_question"
+        )
+        if user_question:
+            if st.session_state.pending_chat is None:
+                process_chat_input(user_question)
+            else:
+                st.toast("Please wait for the current answer before asking another question.")
+        
+        if st.session_state.pending_chat is not None:
+            with pending_container:
+                render_pending_chat(st.session_state.pending_chat)
+        
+        if st.session_state.chat_error:
+            st.error(st.session_state.chat_error)
+
+
+@st.fragment(run_every=CHAT_POLL_SECONDS)
+def render_pending_chat(pending_chat):
+    """Show the pending answer as it streams in, checking the background call on a timer.
+    
+    Each run returns straight away, so other panels' interactions are handled between
+    refreshes. Once the call is done its answer is moved into the chat history.
+    """
+    future = pending_chat["future"]
+    st.chat_message("user").write(pending_chat["question"])
+    if not future.done():
+        st.chat_message("assistant").markdown("".join(pending_chat["chunks"]) or "*Thinking...*")
+        return
+    
+    # A refresh may still be queued after the case was restarted
+    if st.session_state.pending_chat is not pending_chat:
+        return
+    
+    # Keep the answer, or the error if the call failed
+    if future.cancelled():
+        st.session_state.chat_error = "The question was cancelled before it was answered."
+    elif future.exception() is not None:
+        st.session_state.chat_error = f"Sorry, the question could not be answered: {future.exception()}"
+    else:
+        st.session_state.chat_history.append({
+            "question": pending_chat["question"],
+            "answer": future.result()
+        })
+        st.session_state.latencies.append(pending_chat["stats"])
+    st.session_state.pending_chat = None
+    
+    # Redraw the chat with the answer in its history, which also stops the refreshes
+    st.rerun()
+
+
+def reset_case():
+    """Reset the case to its initial presentation with fresh agents and cleared stored sessions."""
+    # Stop any chat answer still running, so the old chat agent can't write its
+    # session back after it has been cleared. Cancelling normally lands at once; if
+    # the call hasn't stopped shortly after, its session is left alone instead
+    chat_stopped = True
+    pending_chat = st.session_state.pending_chat
+    if pending_chat is not None:
+        pending_chat["future"].cancel()
+        chat_stopped = pending_chat["finished"].wait(timeout=1)
+    
+    # Clear the stored conversations so they don't carry over into the new attempt
+    if st.session_state.agent is not None:
+        MedicalCaseAgent.clear_session(st.session_state.agent)
+    if st.session_state.chat_agent is not None and chat_stopped:
+        MedicalCaseAgent.clear_session(st.session_state.chat_agent)
+    st.session_state.agent = MedicalCaseAgent.initialize_agent(
+        user_id=st.session_state.user_id
+    )
+    st.session_state.chat_agent = MedicalCaseAgent.initialize_chat_agent(
+        user_id=st.session_state.user_id
+    )
+    
+    # Keep the presentation across attempts, generating it the first time
+    if st.session_state.initial_presentation is None:
+        st.session_state.initial_presentation = MedicalCaseAgent.start_case(
+            st.session_state.agent
         )
+    initial_presentation = st.session_state.initial_presentation
+    
+    st.session_state.current_step = 0
+    st.session_state.case_history = [initial_presentation]
+    st.session_state.user_decisions = []
+    st.session_state.history_summary = ""
+    st.session_state.summarized_count = 0
+    st.session_state.history_str = initial_presentation
+    st.session_state.decisions_str = ""
+    st.session_state.case_completed = False
+    st.session_state.chat_history = []
+    st.session_state.pending_chat = None
+    st.session_state.chat_error = None
 
 
 def render_case_selection():
     """Render the case selection screen."""
     st.title("📋 Medical Case Trainer")
     
-    # Initialize agent if not already done
+    # Initialize agents if not already done
     if not st.session_state.agent:
         st.session_state.agent = MedicalCaseAgent.initialize_agent(
             user_id=st.session_state.user_id
         )
+    if not st.session_state.chat_agent:
+        st.session_state.chat_agent = MedicalCaseAgent.initialize_chat_agent(
+            user_id=st.session_state.user_id
+        )
     
     # Display CME credits earned
     if st.session_state.cme_earned:
@@ -531,22 +1131,15 @@ def render_case_selection():
             # Center the button
             st.write("")
             st.write("")
-            if st.button("Start Case", use_container_width=True):
-                # Start the case
-                initial_presentation = MedicalCaseAgent.start_case(
-                    st.session_state.agent
-                )
-                
-                # Set session state
-                st.session_state.case_started = True
-                st.session_state.current_step = 0
-                st.session_state.case_history = [initial_presentation]
-                st.session_state.user_decisions = []
-                st.session_state.case_completed = False
-                st.session_state.chat_history = []
-                
-                # Rerun to show case interface
-                st.rerun()
+            start_button = st.button("Start Case", use_container_width=True)
+    
+    if start_button:
+        # Start from a clean attempt, even when returning to a case played before
+        reset_case()
+        st.session_state.case_started = True
+        
+        # Rerun to show case interface
+        st.rerun()
     
     # Show CME information
     st.markdown("---")
@@ -564,6 +1157,61 @@ def render_case_selection():
     """)
 
 
+@st.fragment
+def render_decision_panel():
+    """Render the decision options for the current step and handle submission."""
+    # Get the appropriate stage based on step index, following a fixed sequence
+    current_step = st.session_state.current_step
+    
+    # Get options based on the current step index
+    options = MedicalCaseAgent.get_case_options(current_step)
+    
+    # Action input based on current step
+    step_headers = [
+        "Initial Diagnostic Workup", 
+        "Initial Treatment Decision", 
+        "Catheterization Intervention",
+        "Post-Intervention Management"
+    ]
+    
+    current_header = "Decision Point"
+    if current_step < len(step_headers):
+        current_header = step_headers[current_step]
+    
+    st.markdown(f"### {current_header}")
+    
+    # Display options without hints or explanations
+    selected_option = st.radio("Select your approach:", options, index=None)
+    action = selected_option if selected_option else "No selection"
+    
+    # Action buttons
+    submit_button = st.button("Submit Decision", type="primary", disabled=(not selected_option))
+    if submit_button:
+        # Record the decision
+        append_user_decision(action)
+        
+        # Progress the case, streaming the response as it is generated
+        with timed(f"llm_step_{st.session_state.current_step}") as record:
+            next_info = render_stream(MedicalCaseAgent.progress_case(
+                st.session_state.agent,
+                action,
+                st.session_state.current_step
+            ))
+            record.update(token_usage(st.session_state.agent.run_response))
+        
+        # Mark case as completed once the final successful step has been evaluated
+        if MedicalCaseAgent.completes_case(action, st.session_state.current_step):
+            st.session_state.case_completed = True
+            st.session_state.cme_earned = True
+        
+        # Update session state
+        append_case_history(next_info)
+        st.session_state.current_step += 1
+        
+        # Rerun to update the interface
+        st.rerun()
+
+
 def render_case_interface():
     """Render the interactive case interface."""
     
@@ -619,49 +1267,10 @@ def render_case_interface():
     # Create a separation between case info/chat and decision section
     st.markdown("---")
     
-    # Get the appropriate stage based on step index, following a fixed sequence
-    current_step = st.session_state.current_step
-    
-    # Get options based on the current step index
-    options = MedicalCaseAgent.get_case_options(current_step)
+    # Render the decision section; choosing an option reruns only this panel
+    render_decision_panel()
     
-    # Action input based on current step
-    step_headers = [
-        "Initial Diagnostic Workup", 
-        "Initial Treatment Decision", 
-        "Catheterization Intervention",
-        "Post-Intervention Management"
-    ]
-    
-    current_header = "Decision Point"
-    if current_step < len(step_headers):
-        current_header = step_headers[current_step]
-    
-    st.markdown(f"### {current_header}")
-    
-    # Display options without hints or explanations
-    selected_option = st.radio("Select your approach:", options, index=None)
-    action = selected_option if selected_option else "No selection"
-    
-    # Action buttons
-    submit_button = st.button("Submit Decision", type="primary", disabled=(not selected_option))
-    if submit_button:
-        # Record the decision
-        st.session_state.user_decisions.append(action)
-        
-        # Progress the case
-        next_info = MedicalCaseAgent.progress_case(
-            st.session_state.agent,
-            action,
-            st.session_state.current_step
-        )
-        
-        # Update session state
-        st.session_state.case_history.append(next_info)
-        st.session_state.current_step += 1
-        
-        # Rerun to update the interface
-        st.rerun()
+    current_step = st.session_state.current_step
     
     # Show case history in the sidebar
     with st.sidebar:
@@ -677,28 +1286,24 @@ def render_case_interface():
             st.info(f"Current Stage: {current_stage.capitalize()}")
         
         # Option to restart case
-        if st.button("Restart Case"):
-            # Reset session state but keep the same case
-            initial_presentation = MedicalCaseAgent.start_case(
-                st.session_state.agent
-            )
-            
-            st.session_state.current_step = 0
-            st.session_state.case_history = [initial_presentation]
-            st.session_state.user_decisions = []
-            st.session_state.case_completed = False
-            st.session_state.chat_history = []
-            
-            st.rerun()
+        restart_button = st.button("Restart Case")
         
         # Option to exit case
         if st.button("Exit Case"):
             st.session_state.case_started = False
             st.rerun()
+    
+    if restart_button:
+        # Reset session state but keep the same case and its initial presentation
+        reset_case()
+        st.rerun()
 
 
 def main():
     """Main application entry point."""
+    # Make sure the background loop for async agent calls is running
+    get_event_loop()
+    
     st.sidebar.title("🏥 Medical Case Trainer")
     st.sidebar.markdown("Interactive CME for Physicians")
     
@@ -708,6 +1313,13 @@ def main():
     else:
         render_case_interface()
     
+    # Recent model call timings for spotting where latency comes from
+    with st.sidebar.expander("Debug: LLM Latencies"):
+        if st.session_state.latencies:
+            st.table(st.session_state.latencies[-10:])
+        else:
+            st.caption("No model calls yet")
+    
     # Footer
     st.sidebar.markdown("---")
     st.sidebar.markdown("© 2025 Medical Case Trainer")